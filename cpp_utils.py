@@ -1,8 +1,11 @@
+import bisect
+import contextlib
 import logging
 import re
-from functools import partial
+from functools import lru_cache
 
 import ida_bytes
+import ida_funcs
 import ida_hexrays
 import ida_name
 import ida_struct
@@ -27,7 +30,139 @@ VTABLE_INSTANCE_DELIMITER = VTABLE_DELIMITER
 VTABLE_INSTANCE_KEYWORD = "vftable"
 VTABLE_INSTANCE_POSTFIX = VTABLE_INSTANCE_DELIMITER + VTABLE_INSTANCE_KEYWORD
 
+# register annotations of __usercall/__userpurge types, i.e. "int@<eax>"
+_USERPURGE_ANNOT_RE = re.compile(r"@<\w+>")
+
+# calling conventions printed as __usercall/__userpurge
+_SPECIAL_CCS = (idaapi.CM_CC_SPECIAL, idaapi.CM_CC_SPECIALE, idaapi.CM_CC_SPECIALP)
+
+# by-name lookups and func types are needed many times for the same classes/vtables/funcs
+# during a build, so they're cached. The caches exist only inside of batch_scope() (they're None
+# outside of it), since structs and types could be changed by user between runs.
+# Only successful by-name lookups are cached (so creating new structs doesn't require
+# invalidation), and entries are dropped when we rename structs or change func types ourselves.
+_STRUC_ID_CACHE = None  # dict(str, tid_t)
+_TYPEINF_CACHE = None  # dict(str, tinfo_t)
+_TYPEINF_PTR_CACHE = None  # dict(str, tinfo_t)
+_STRUCT_IS_VTABLE_CACHE = None  # dict(tid_t, bool)
+# func ea -> func type, as returned by utils.get_func_type(). Getting func type usually
+# means decompiling the func, and it's needed several times for each vtable slot.
+_FUNC_TYPE_CACHE = None  # dict(int, tuple(type, fields))
+
+
+@contextlib.contextmanager
+def batch_scope():
+    """Cache lookups until the outermost scope is left, usable as a decorator too"""
+    # pylint: disable=global-statement
+    global _STRUC_ID_CACHE, _TYPEINF_CACHE, _TYPEINF_PTR_CACHE
+    global _STRUCT_IS_VTABLE_CACHE, _FUNC_TYPE_CACHE
+    if _in_batch_scope():
+        yield
+        return
+    _STRUC_ID_CACHE = {}
+    _TYPEINF_CACHE = {}
+    _TYPEINF_PTR_CACHE = {}
+    _STRUCT_IS_VTABLE_CACHE = {}
+    _FUNC_TYPE_CACHE = {}
+    utils.clear_struct_members_cache()
+    try:
+        yield
+    finally:
+        _STRUC_ID_CACHE = None
+        _TYPEINF_CACHE = None
+        _TYPEINF_PTR_CACHE = None
+        _STRUCT_IS_VTABLE_CACHE = None
+        _FUNC_TYPE_CACHE = None
+        utils.clear_struct_members_cache()
+
+
+def _in_batch_scope():
+    return _FUNC_TYPE_CACHE is not None
+
+
+def _get_member_at(sptr, offset):
+    """Same as ida_struct.get_member(), but without searching struct members on each call"""
+    if sptr.is_union() or not _in_batch_scope():
+        return ida_struct.get_member(sptr, offset)
+    offsets, members = utils.get_struct_members(sptr)
+    i = bisect.bisect_right(offsets, offset) - 1
+    if i < 0 or offset >= members[i].eoff:
+        return None
+    return members[i]
+
+
+def _get_func_type(func_ea):
+    if _FUNC_TYPE_CACHE is None:
+        return utils.get_func_type(func_ea)
+    if func_ea not in _FUNC_TYPE_CACHE:
+        _FUNC_TYPE_CACHE[func_ea] = utils.get_func_type(func_ea)
+    return _FUNC_TYPE_CACHE[func_ea]
+
+
+def _forget_func_type(func_ea):
+    """Must be called before changing func type"""
+    if _FUNC_TYPE_CACHE is not None:
+        _FUNC_TYPE_CACHE.pop(func_ea, None)
+
+
+def _get_func_tinfo(func_ea):
+    return utils.deserialize_tinfo(_get_func_type(func_ea))
+
+
+def _get_func_details(func_ea):
+    func_type = _get_func_type(func_ea)
+    if func_type is None:
+        # utils.get_func_details() would try to get func type once again
+        return None
+    return utils.get_func_details(func_ea, func_type)
+
+
+def _forget_name(name):
+    if not _in_batch_scope():
+        return
+    _STRUC_ID_CACHE.pop(name, None)
+    _TYPEINF_CACHE.pop(name, None)
+    _TYPEINF_PTR_CACHE.pop(name, None)
+
 
+def _get_struc_id(name):
+    if not _in_batch_scope():
+        return ida_struct.get_struc_id(name)
+    sid = _STRUC_ID_CACHE.get(name)
+    if sid is None:
+        sid = ida_struct.get_struc_id(name)
+        if sid != BADADDR:
+            _STRUC_ID_CACHE[name] = sid
+    return sid
+
+
+def _sptr(name):
+    return ida_struct.get_struc(_get_struc_id(name))
+
+
+def _typeinf(name):
+    if not _in_batch_scope():
+        return utils.get_typeinf(name)
+    tif = _TYPEINF_CACHE.get(name)
+    if tif is None:
+        tif = utils.get_typeinf(name)
+        if tif is not None:
+            _TYPEINF_CACHE[name] = tif
+    return tif
+
+
+def _typeinf_ptr(name):
+    if not _in_batch_scope():
+        return utils.get_typeinf_ptr(utils.get_typeinf(name) or name)
+    tif = _TYPEINF_PTR_CACHE.get(name)
+    if tif is None:
+        tif = utils.get_typeinf_ptr(_typeinf(name) or name)
+        if tif is not None:
+            _TYPEINF_PTR_CACHE[name] = tif
+    return tif
+
+
+@lru_cache(maxsize=4096)
 def get_vtable_instance_name(class_name, parent_name=None):
     name = class_name + VTABLE_INSTANCE_POSTFIX
     if parent_name is not None:
@@ -39,20 +174,63 @@ def get_base_member_name(parent_name, offset):
     return "%s_%X" % (parent_name, offset)
 
 
-def get_vtable_line(ea, stop_ea=None, ignore_list=None, pure_virtual_name=None):
+def get_vtable_line(ea, stop_ea=None, ignore_list=None, pure_virtual_ea=None, word_len=None):
     if ignore_list is None:
-        ignore_list = []
+        ignore_list = frozenset()
     func_ea = utils.get_ptr(ea)
     if not utils.is_func_start(func_ea):
         return None, 0
     if stop_ea is not None and ea >= stop_ea:
         return None, 0
-    is_pure_func = pure_virtual_name is not None and idc.GetDisasm(ea).endswith(pure_virtual_name)
+    is_pure_func = pure_virtual_ea is not None and func_ea == pure_virtual_ea
     if func_ea in ignore_list and not is_pure_func:
         return None, 0
-    return func_ea, ea + utils.get_word_len()
+    if word_len is None:
+        word_len = utils.get_word_len()
+    return func_ea, ea + word_len
 
 
+def _collect_vtable_slots(vtable_ea, stop_ea=None, ignore_set=frozenset(), pure_virtual_ea=None):
+    """
+    Same as calling get_vtable_line() until it returns None, but in one tight loop
+    @return: list of funcs eas
+    """
+    word_len = utils.get_word_len()
+    get_ptr = ida_bytes.get_qword if word_len == 8 else ida_bytes.get_dword
+    get_func = ida_funcs.get_func
+    funcs_eas = []
+    ea = vtable_ea
+    while stop_ea is None or ea < stop_ea:
+        func_ea = get_ptr(ea)
+        func = get_func(func_ea)
+        if func is None or func.start_ea != func_ea:
+            break
+        if func_ea in ignore_set and func_ea != pure_virtual_ea:
+            break
+        funcs_eas.append(func_ea)
+        ea += word_len
+    return funcs_eas
+
+
+def _collect_vtable_slots_by_callback(
+    vtable_ea, stop_ea, get_next_func_callback, ignore_list, pure_virtual_ea
+):
+    """@return: list of funcs eas"""
+    funcs_eas = []
+    ea = vtable_ea
+    func_ea, next_func = get_next_func_callback(
+        ea, ignore_list=ignore_list, pure_virtual_ea=pure_virtual_ea
+    )
+    while func_ea is not None and (stop_ea is None or ea < stop_ea):
+        funcs_eas.append(func_ea)
+        ea = next_func
+        func_ea, next_func = get_next_func_callback(
+            ea, ignore_list=ignore_list, pure_virtual_ea=pure_virtual_ea
+        )
+    return funcs_eas
+
+
+@lru_cache(maxsize=1024)
 def is_valid_vtable_name(member_name):
     return VTABLE_FIELD_NAME in member_name
 
@@ -65,10 +243,10 @@ def is_valid_vtable_type(member, member_type):
 
 
 def is_member_vtable(member):
-    member_type = utils.get_member_tinfo(member)
     member_name = ida_struct.get_member_name(member.id)
     if not is_valid_vtable_name(member_name):
         return False
+    member_type = utils.get_member_tinfo(member)
     if not is_valid_vtable_type(member, member_type):
         return False
     return True
@@ -77,8 +255,14 @@ def is_member_vtable(member):
 def is_struct_vtable(struct):
     if struct is None:
         return False
-    struct_name = ida_struct.get_struc_name(struct.id)
-    return VTABLE_POSTFIX in struct_name
+    if not _in_batch_scope():
+        return VTABLE_POSTFIX in ida_struct.get_struc_name(struct.id)
+    # the only struct rename done here is in install_vtables_union(), which drops the entry
+    res = _STRUCT_IS_VTABLE_CACHE.get(struct.id)
+    if res is None:
+        res = VTABLE_POSTFIX in ida_struct.get_struc_name(struct.id)
+        _STRUCT_IS_VTABLE_CACHE[struct.id] = res
+    return res
 
 
 def is_vtables_union(union):
@@ -97,7 +281,7 @@ def is_vtables_union_name(union_name):
 def find_vtable_at_offset(struct_ptr, vtable_offset):
     current_struct = struct_ptr
     current_offset = 0
-    member = ida_struct.get_member(current_struct, vtable_offset)
+    member = _get_member_at(current_struct, vtable_offset)
     if member is None:
         return None
     parents_vtables_classes = []
@@ -112,7 +296,7 @@ def find_vtable_at_offset(struct_ptr, vtable_offset):
                 vtable_offset - current_offset,
             ]
         )
-        member = ida_struct.get_member(current_struct, vtable_offset - current_offset)
+        member = _get_member_at(current_struct, vtable_offset - current_offset)
         if member is None:
             log.exception(
                 "Couldn't find vtable at offset %d for %d",
@@ -131,11 +315,12 @@ def find_vtable_at_offset(struct_ptr, vtable_offset):
         if current_struct is None:
             return None
         parents_vtables_classes.append([ida_struct.get_struc_name(current_struct.id), 0])
-        member = ida_struct.get_member(current_struct, 0)
+        member = _get_member_at(current_struct, 0)
 
     return None
 
 
+@lru_cache(maxsize=4096)
 def get_class_vtable_struct_name(class_name, vtable_offset_in_class):
     if vtable_offset_in_class == 0:
         return class_name + VTABLE_POSTFIX
@@ -150,6 +335,7 @@ def get_class_vtables_union_name(class_name):
     return class_name + VTABLE_DELIMITER + VTABLE_UNION_KEYWORD
 
 
+@lru_cache(maxsize=4096)
 def get_class_vtables_field_name(child_name):
     return child_name + VTABLES_UNION_VTABLE_FIELD_POSTFIX
 
@@ -172,7 +358,7 @@ def install_vtables_union(class_name, class_vtable_member=None, vtable_member_ti
         old_vtable_class_name = ida_struct.get_struc_name(old_vtable_sptr.id)
     else:
         old_vtable_class_name = get_class_vtable_struct_name(class_name, offset)
-        old_vtable_sptr = utils.get_sptr_by_name(old_vtable_class_name)
+        old_vtable_sptr = _sptr(old_vtable_class_name)
     vtables_union_name = old_vtable_class_name
     if old_vtable_sptr and not ida_struct.set_struc_name(
         old_vtable_sptr.id, old_vtable_class_name + "_orig"
@@ -185,8 +371,12 @@ def install_vtables_union(class_name, class_vtable_member=None, vtable_member_ti
         )
         # FIXME: why -1 and not None?
         return -1
+    _forget_name(old_vtable_class_name)
+    _forget_name(old_vtable_class_name + "_orig")
+    if _in_batch_scope():
+        _STRUCT_IS_VTABLE_CACHE.pop(old_vtable_sptr.id, None)
     vtables_union_id = utils.get_or_create_struct_id(vtables_union_name, True)
-    vtable_member_tinfo = utils.get_typeinf(old_vtable_class_name + "_orig")
+    vtable_member_tinfo = _typeinf(old_vtable_class_name + "_orig")
     if vtables_union_id == BADADDR:
         log.exception(
             "Cannot create union vtable for %s()%s",
@@ -205,12 +395,12 @@ def install_vtables_union(class_name, class_vtable_member=None, vtable_member_ti
     else:
         vtables_union_vtable_field_name = get_interface_empty_vtable_name()
     utils.add_to_struct(vtables_union, vtables_union_vtable_field_name, vtable_member_tinfo)
-    parent_struct = utils.get_sptr_by_name(class_name)
+    parent_struct = _sptr(class_name)
     flag = idaapi.FF_STRUCT
     mt = idaapi.opinfo_t()
     mt.tid = vtables_union_id
     struct_size = ida_struct.get_struc_size(vtables_union_id)
-    vtables_union_ptr_type = utils.get_typeinf_ptr(vtables_union_name)
+    vtables_union_ptr_type = _typeinf_ptr(vtables_union_name)
     if class_vtable_member:
         member_ptr = class_vtable_member
     else:
@@ -232,6 +422,7 @@ def install_vtables_union(class_name, class_vtable_member=None, vtable_member_ti
         vtables_union_ptr_type,
         idaapi.TINFO_DEFINITE,
     )
+    utils.forget_struct_members(parent_struct)
     # FIXME: might be None! Is this OK, considering we return -1 everywhere else?
     return vtables_union
 
@@ -243,9 +434,9 @@ def add_child_vtable(parent_name, child_name, child_vtable_id, offset):
         child_name,
         child_vtable_id,
     )
-    parent_vtable_member = ida_struct.get_member(utils.get_sptr_by_name(parent_name), offset)
+    parent_vtable_member = ida_struct.get_member(_sptr(parent_name), offset)
     vtable_member_tinfo = utils.get_member_tinfo(parent_vtable_member)
-    parent_vtable_struct = utils.get_sptr_by_name(get_class_vtable_struct_name(parent_name, offset))
+    parent_vtable_struct = _sptr(get_class_vtable_struct_name(parent_name, offset))
     if parent_vtable_struct is None:
         return
     pointed_struct = utils.extract_struct_from_tinfo(vtable_member_tinfo)
@@ -266,7 +457,7 @@ def add_child_vtable(parent_name, child_name, child_vtable_id, offset):
         )
 
     child_vtable_name = ida_struct.get_struc_name(child_vtable_id)
-    child_vtable = utils.get_typeinf(child_vtable_name)
+    child_vtable = _typeinf(child_vtable_name)
     log.debug("add_to_struct %d %s", parent_vtable_struct.id, str(child_vtable))
     if ida_struct.get_struc_size(child_vtable_id) == 0:
         utils.add_to_struct(ida_struct.get_struc(child_vtable_id), "dummy", None)
@@ -290,7 +481,7 @@ def update_func_this(func_ea, this_type=None, flags=idc.TINFO_DEFINITE):
     #if idc.get_tinfo(func_ea) is not None:
     #    # don't touch any user defined type
     #    return False
-    func_details = utils.get_func_details(func_ea)
+    func_details = _get_func_details(func_ea)
     if not func_details:
         return False
     if func_details.cc != idaapi.CM_CC_THISCALL and func_details.cc != idaapi.CM_CC_FASTCALL:
@@ -298,6 +489,7 @@ def update_func_this(func_ea, this_type=None, flags=idc.TINFO_DEFINITE):
     func_details[0].name = "this"
     if this_type:
         func_details[0].type = this_type
+    _forget_func_type(func_ea)
     return utils.apply_func_details(func_ea, func_details, flags)
 
 
@@ -305,8 +497,8 @@ def add_class_vtable(struct_ptr, vtable_name, offset=BADADDR, vtable_field_name=
     if vtable_field_name is None:
         class_name = ida_struct.get_struc_name(struct_ptr.id)
         vtable_field_name = get_class_vtable_field_name(class_name)
-    vtable_id = ida_struct.get_struc_id(vtable_name)
-    vtable_type_ptr = utils.get_typeinf_ptr(vtable_name)
+    vtable_id = _get_struc_id(vtable_name)
+    vtable_type_ptr = _typeinf_ptr(vtable_name)
     new_member = utils.add_to_struct(
         struct_ptr, vtable_field_name, vtable_type_ptr, offset, overwrite=True
     )
@@ -321,7 +513,7 @@ def add_class_vtable(struct_ptr, vtable_name, offset=BADADDR, vtable_field_name=
 
 
 def make_funcptr_pt(func, this_type):
-    return utils.get_typeinf("void (*)(%s *)" % str(this_type))
+    return _typeinf("void (*)(%s *)" % str(this_type))
 
 
 def fix_userpurge(funcea, flags=idc.TINFO_DEFINITE):
@@ -329,23 +521,43 @@ def fix_userpurge(funcea, flags=idc.TINFO_DEFINITE):
     funcea = utils.get_func_start(funcea)
     if funcea == BADADDR:
         return False
-    tif = utils.get_func_tinfo(funcea)
+    tif = _get_func_tinfo(funcea)
     if not tif:
         return False
+    # don't print types of the funcs with regular calling conventions
+    if (tif.get_cc() & idaapi.CM_CC_MASK) not in _SPECIAL_CCS:
+        return False
     typestr = str(tif)
     if not typestr:
         return False
     if "__userpurge" not in typestr:
         return False
     typestr = typestr.replace("__userpurge", "(__thiscall)")
-    typestr = re.sub(r"\@\<\w+\>", "", typestr)
+    typestr = _USERPURGE_ANNOT_RE.sub("", typestr)
     py_type = idc.parse_decl(typestr, idc.PT_SILENT)
     if not py_type:
         log.warn("%08X Failed to fix userpurge", funcea)
         return False
+    _forget_func_type(funcea)
     return idc.apply_type(funcea, py_type[1:], flags)
 
 
+def _get_up_to_date_member(struct_ptr, offset, member_name, member_tif):
+    """@return: member_ptr at offset if it already has given name and type, otherwise None"""
+    member = ida_struct.get_member(struct_ptr, offset)
+    if member is None or member.get_soff() != offset:
+        return None
+    if ida_struct.get_member_name(member.id) != member_name:
+        return None
+    old_tif = utils.get_member_tinfo(member)
+    if old_tif is None and member_tif is None:
+        return member
+    if old_tif and member_tif and old_tif == member_tif:
+        return member
+    return None
+
+
+@batch_scope()
 def update_vtable_struct(
     functions_ea,
     vtable_struct,
@@ -355,41 +567,53 @@ def update_vtable_struct(
     vtable_head=None,
     ignore_list=None,
     add_dummy_member=False,
-    pure_virtual_name=None,
+    pure_virtual_ea=None,
     parent_name=None,
     add_func_this=True,
     force_rename_vtable_head=False,  # rename vtable head even if it is already named by IDA
     # if it's not named, then it will be renamed anyway
+    stop_ea=None,
 ):
     # pylint: disable=too-many-arguments,too-many-locals,too-many-branches
     # TODO: refactor
     if this_type is None:
-        this_type = utils.get_typeinf_ptr(class_name)
+        this_type = _typeinf_ptr(class_name)
     if not add_func_this:
         this_type = None
-    func_ea, next_func = get_next_func_callback(
-        functions_ea,
-        ignore_list=ignore_list,
-        pure_virtual_name=pure_virtual_name,
-    )
+    ignore_list = frozenset(ignore_list or ())
+    word_len = utils.get_word_len()
+    is_decompiler_on = ida_hexrays.init_hexrays_plugin()
+    # the same for all slots. TODO: maybe try to get or guess type?
+    default_func_ptr = None if is_decompiler_on else make_funcptr_pt(None, this_type)
+    # read the whole vtable first, so that reads don't interleave with db modifications below
+    if get_next_func_callback is get_vtable_line:
+        funcs_eas = _collect_vtable_slots(functions_ea, stop_ea, ignore_list, pure_virtual_ea)
+    else:
+        funcs_eas = _collect_vtable_slots_by_callback(
+            functions_ea, stop_ea, get_next_func_callback, ignore_list, pure_virtual_ea
+        )
     dummy_i = 1
     offset = 0
-    while func_ea is not None:
+    pending_xrefs = []  # list(tuple(member_id, func_ea))
+    for func_ea in funcs_eas:
         new_func_name, _ = update_func_name_with_class(func_ea, class_name)
         func_ptr = None
-        if ida_hexrays.init_hexrays_plugin():
+        if is_decompiler_on:
             fix_userpurge(func_ea, idc.TINFO_GUESSED)
             update_func_this(func_ea, this_type, idc.TINFO_GUESSED)
-            func_ptr = utils.get_typeinf_ptr(utils.get_func_tinfo(func_ea))
+            func_ptr = utils.get_typeinf_ptr(_get_func_tinfo(func_ea))
         else:
-            func_ptr = make_funcptr_pt(func_ea, this_type)  # TODO: maybe try to get or guess type?
+            func_ptr = default_func_ptr
         if add_dummy_member:
             utils.add_to_struct(vtable_struct, "dummy_%d" % dummy_i, func_ptr)
             dummy_i += 1
-            offset += utils.get_word_len()
-        ptr_member = utils.add_to_struct(
-            vtable_struct, new_func_name, func_ptr, offset, overwrite=True, is_offs=True
-        )
+            offset += word_len
+        # the member is already in place if this vtable was built before
+        ptr_member = _get_up_to_date_member(vtable_struct, offset, new_func_name, func_ptr)
+        if ptr_member is None:
+            ptr_member = utils.add_to_struct(
+                vtable_struct, new_func_name, func_ptr, offset, overwrite=True, is_offs=True
+            )
         if ptr_member is None:
             log.error(
                 "Couldn't add %s(%s) to vtable struct 0x%X at offset 0x%X",
@@ -398,18 +622,18 @@ def update_vtable_struct(
                 vtable_struct.id,
                 offset,
             )
-        offset += utils.get_word_len()
-        if not ida_xref.add_dref(ptr_member.id, func_ea, ida_xref.XREF_USER | ida_xref.dr_I):
+        else:
+            # member ids stay valid while the struct is being changed, member ptrs don't
+            pending_xrefs.append((ptr_member.id, func_ea))
+        offset += word_len
+
+    for member_id, func_ea in pending_xrefs:
+        if not ida_xref.add_dref(member_id, func_ea, ida_xref.XREF_USER | ida_xref.dr_I):
             log.warn(
                 "Couldn't create xref between member %s and func %s",
-                ida_struct.get_member_name(ptr_member.id),
+                ida_struct.get_member_name(member_id),
                 idc.get_name(func_ea),
             )
-        func_ea, next_func = get_next_func_callback(
-            next_func,
-            ignore_list=ignore_list,
-            pure_virtual_name=pure_virtual_name,
-        )
 
     vtable_size = ida_struct.get_struc_size(vtable_struct)
 
@@ -430,43 +654,27 @@ def update_vtable_struct(
         )
 
 
-def is_valid_func_char(c):
-    ALLOWED_CHARS = [":", "_"]
-    return c.isalnum() or c in ALLOWED_CHARS
+# name with optional namespaces, i.e. "A::B::sub_1234"
+_CPPNAME_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*(?:::[A-Za-z0-9_]+)*")
 
 
 def find_valid_cppname_in_line(line, idx):
-    end_idx = idx
-    start_idx = idx
-    if len(line) < idx:
-        return None
-    while start_idx >= 0 and is_valid_func_char(line[start_idx]):
-        if line[start_idx] == ":":
-            if line[start_idx - 1] == ":":
-                start_idx -= 1
-            else:
-                break
-        start_idx -= 1
-    while end_idx < len(line) and is_valid_func_char(line[end_idx]):
-        if line[end_idx] == ":":
-            if line[end_idx + 1] == ":":
-                end_idx += 1
-            else:
-                break
-        end_idx += 1
-    if end_idx > start_idx:
-        return line[start_idx + 1 : end_idx]
+    for match in _CPPNAME_RE.finditer(line):
+        if match.start() > idx:
+            break
+        if idx <= match.end():
+            return match.group(0)
     return None
 
 
 def get_overriden_func_names(union_name, offset, get_not_funcs_members=False):
-    sptr = utils.get_sptr_by_name(union_name)
+    """@return: list of tuple(class_name, func_name)"""
+    sptr = _sptr(union_name)
     res = []
-    if not sptr.is_union:
+    if not sptr or not sptr.is_union():
         return res
 
-    for i in range(ida_struct.get_max_offset(sptr)):
-        member = ida_struct.get_member(sptr, i)
+    for _, member in utils.iter_members(sptr):
         cls = ida_struct.get_member_name(member.id)
         tinfo = utils.get_member_tinfo(member)
         log.debug("Trying %s", cls)
@@ -475,7 +683,7 @@ def get_overriden_func_names(union_name, offset, get_not_funcs_members=False):
         pointed_obj = tinfo.get_pointed_object()
         if not pointed_obj.is_struct():
             continue
-        vtable_sptr = utils.get_sptr_by_name(pointed_obj.get_final_type_name())
+        vtable_sptr = _sptr(pointed_obj.get_final_type_name())
         if ida_struct.get_max_offset(vtable_sptr) <= offset:
             continue
         funcptr_member = ida_struct.get_member(vtable_sptr, offset)
@@ -489,17 +697,16 @@ def get_overriden_func_names(union_name, offset, get_not_funcs_members=False):
 
 def set_polymorhpic_func_name(union_name, offset, name, force=False):
     for _, func_name in get_overriden_func_names(union_name, offset):
-        func_name_splitted = func_name.split(VTABLE_DELIMITER)
-        local_func_name = func_name_splitted[-1]
-        if local_func_name != name and (force or local_func_name.startswith("sub_")):
-            ea = utils.get_func_ea(func_name)
-            if ea != BADADDR:
-                new_func_name = VTABLE_DELIMITER.join(func_name_splitted[:-1])
-                if new_func_name != "":
-                    new_func_name += VTABLE_DELIMITER
-                new_func_name += name
-                log.debug("%08X -> %s", ea, new_func_name)
-                utils.set_func_name(ea, new_func_name)
+        prefix, _, local_func_name = func_name.rpartition(VTABLE_DELIMITER)
+        if local_func_name == name or not (force or local_func_name.startswith("sub_")):
+            continue
+        # resolve the func only for members that are going to be renamed
+        ea = utils.get_func_ea(func_name)
+        if ea == BADADDR:
+            continue
+        new_func_name = prefix + VTABLE_DELIMITER + name if prefix else name
+        log.debug("%08X -> %s", ea, new_func_name)
+        utils.set_func_name(ea, new_func_name)
 
 
 def create_class(class_name, has_vtable, parent_class=None):
@@ -510,6 +717,7 @@ def create_class(class_name, has_vtable, parent_class=None):
     return class_ptr
 
 
+@batch_scope()
 def create_vtable_struct(sptr, name, vtable_offset, parent_name=None):
     log.debug("create_vtable_struct(%s, 0x%X)", name, vtable_offset)
     vtable_details = find_vtable_at_offset(sptr, vtable_offset)
@@ -529,9 +737,9 @@ def create_vtable_struct(sptr, name, vtable_offset, parent_name=None):
         parent_name = ida_struct.get_struc_name(parent_vtable_struct.id)
     vtable_name = get_class_vtable_struct_name(name, vtable_offset)
     if vtable_offset == 0:
-        this_type = utils.get_typeinf_ptr(name)
+        this_type = _typeinf_ptr(name)
     else:
-        this_type = utils.get_typeinf_ptr(parent_name)
+        this_type = _typeinf_ptr(parent_name)
     if vtable_name is None:
         log.exception(
             "create_vtable_struct(%s, 0x%X): vtable_name is" " None",
@@ -539,7 +747,7 @@ def create_vtable_struct(sptr, name, vtable_offset, parent_name=None):
             vtable_offset,
         )
         return None, this_type
-    vtable_id = ida_struct.get_struc_id(vtable_name)
+    vtable_id = _get_struc_id(vtable_name)
     if vtable_id == BADADDR:
         vtable_id = ida_struct.add_struc(BADADDR, vtable_name, False)
     if vtable_id == BADADDR:
@@ -558,7 +766,7 @@ def create_vtable_struct(sptr, name, vtable_offset, parent_name=None):
 
 def make_struct(name, struct_size):
     struc = utils.get_or_create_struct(name)
-    struct_id = ida_struct.get_struc_id(name)
+    struct_id = _get_struc_id(name)
     mt = idaapi.opinfo_t()
     mt.tid = struct_id
     cur_size = ida_struct.get_struc_size(struct_id)
@@ -584,6 +792,7 @@ def make_struct(name, struct_size):
         if r != 0:
             break
         cur_size = ida_struct.get_struc_size(struct_id)
+    utils.forget_struct_members(struc)
     return cur_size
 
 def find_structs_by_size(size = None, min_size: int = 0, ignore_prefixes: list = []):
@@ -616,6 +825,7 @@ def find_structs_by_size(size = None, min_size: int = 0, ignore_prefixes: list =
 
     return matching_structs
 
+@batch_scope()
 def make_vtable(
     class_name,
     struct_size=None,
@@ -643,22 +853,24 @@ def make_vtable(
         vtable_struct,
         class_name,
         this_type=this_type,
-        get_next_func_callback=partial(_get_vtable_line, stop_ea=vtable_ea_stop),
+        get_next_func_callback=_get_vtable_line,
+        stop_ea=vtable_ea_stop,
         parent_name=parent_name,
         add_func_this=add_func_this,
     )
 
 
+@batch_scope()
 def add_baseclass(class_name, baseclass_name, baseclass_offset=0, to_refresh=False):
     member_name = get_base_member_name(baseclass_name, baseclass_offset)
-    struct_ptr = utils.get_sptr_by_name(class_name)
-    baseclass_ptr = utils.get_sptr_by_name(baseclass_name)
+    struct_ptr = _sptr(class_name)
+    baseclass_ptr = _sptr(baseclass_name)
     if not struct_ptr or not baseclass_ptr:
         return False
     member = utils.add_to_struct(
         struct_ptr,
         member_name,
-        member_tif=utils.get_typeinf(baseclass_name),
+        member_tif=_typeinf(baseclass_name),
         offset=baseclass_offset,
         overwrite=True,
     )
@@ -40,6 +40,7 @@ class RTTIParser(object):
         return cls.extract_rtti_info_from_typeinfo(typeinfo_ea)
 
     @classmethod
+    @cpp_utils.batch_scope()
     def extract_rtti_info_from_typeinfo(cls, typeinfo_ea):
         if typeinfo_ea in cls.found_classes:
             return None
@@ -194,6 +195,7 @@ class GccRTTIParser(RTTIParser):
         cls.type_si = ida_name.get_name_ea(idaapi.BADADDR, cls.SI) + get_OFFSET_FROM_TYPEINF_SYM()
         cls.type_none = ida_name.get_name_ea(idaapi.BADADDR, cls.NONE) + get_OFFSET_FROM_TYPEINF_SYM()
         cls.types = (cls.type_vmi, cls.type_si, cls.type_none)
+        cls.pure_virtual_ea = ida_name.get_name_ea(idaapi.BADADDR, cls.pure_virtual_name)
 
     @classmethod
     def build_all(cls):
@@ -204,6 +206,7 @@ class GccRTTIParser(RTTIParser):
 
     @classmethod
     @utils.batchmode
+    @cpp_utils.batch_scope()
     def build_class_type(cls, class_type):
         idx = 0
         for xref in idautils.XrefsTo(class_type - get_OFFSET_FROM_TYPEINF_SYM()):
@@ -302,7 +305,7 @@ class GccRTTIParser(RTTIParser):
         func_ea, _ = cpp_utils.get_vtable_line(
             functions_ea,
             ignore_list=self.types,
-            pure_virtual_name=self.pure_virtual_name,
+            pure_virtual_ea=self.pure_virtual_ea,
         )
         if func_ea is None:
             return None
@@ -314,6 +317,6 @@ class GccRTTIParser(RTTIParser):
             self.name,
             this_type,
             ignore_list=self.types,
-            pure_virtual_name=self.pure_virtual_name,
+            pure_virtual_ea=self.pure_virtual_ea,
         )
         return vtable_struct
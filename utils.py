@@ -209,9 +209,14 @@ def get_func_tinfo(funcea):
     return deserialize_tinfo(get_func_type(funcea))
 
 
-def get_func_details(funcea):
-    """@return: func_type_data_t"""
-    func_tif = deserialize_tinfo(get_func_type(funcea))
+def get_func_details(funcea, func_type=None):
+    """
+    @param func_type: tuple(type, fields) of the func at funcea, if it's already known
+    @return: func_type_data_t
+    """
+    if func_type is None:
+        func_type = get_func_type(funcea)
+    func_tif = deserialize_tinfo(func_type)
     if func_tif is None:
         log.warning("%08X Couldn't get func type", funcea)
         return None
@@ -257,6 +262,45 @@ def get_member_params(member_tif, is_offs):
     return flag, mt, member_size
 
 
+# struct id -> tuple(members offsets, members), see get_struct_members().
+# member_t pointers become dangling when members are added to or deleted from struct, even if
+# memqty stays the same (i.e. refresh_struct() adds and deletes a member). All functions here
+# which add/delete members or change their types call forget_struct_members(), and so must
+# any new code changing struct members directly via ida_struct/idc.
+_STRUCT_MEMBERS_CACHE = {}  # dict(tid_t, tuple(list(int), list(member_t)))
+
+
+def forget_struct_members(sptr):
+    if sptr:
+        _STRUCT_MEMBERS_CACHE.pop(sptr.id, None)
+
+
+def clear_struct_members_cache():
+    _STRUCT_MEMBERS_CACHE.clear()
+
+
+def iter_members(sptr):
+    """@return: generator of tuple(member offset, member_t)"""
+    for i in range(sptr.memqty):
+        member = sptr.get_member(i)
+        if member:
+            yield member.get_soff(), member
+
+
+def get_struct_members(sptr):
+    """@return: tuple(members offsets, members), cached until forget_struct_members(sptr)"""
+    entry = _STRUCT_MEMBERS_CACHE.get(sptr.id)
+    if entry is None or len(entry[1]) != sptr.memqty:
+        offsets = []
+        members = []
+        for soff, member in iter_members(sptr):
+            offsets.append(soff)
+            members.append(member)
+        entry = (offsets, members)
+        _STRUCT_MEMBERS_CACHE[sptr.id] = entry
+    return entry
+
+
 def set_member_name_retry(member_ptr, new_name):
     """@return: True/False"""
     assert member_ptr
@@ -283,6 +327,7 @@ def add_struc_member_retry(struct_ptr, member_name, offset, flag, mt, member_siz
     assert member_name, offset
     assert member_size, offset
 
+    forget_struct_members(struct_ptr)
     error_code = ida_struct.add_struc_member(struct_ptr, member_name, offset, flag, mt, member_size)
     i = 0
     member_base_name = member_name
@@ -314,6 +359,8 @@ def set_member_tinfo(struct_ptr, member_ptr, new_tif, flags=idaapi.TINFO_DEFINIT
     if old_tif and new_tif and new_tif == old_tif:
         return True
 
+    # setting member type can delete overlapping members
+    forget_struct_members(struct_ptr)
     if new_tif is None:
         if not ida_struct.del_member_tinfo(struct_ptr, member_ptr):
             return ida_struct.SMT_FAILED
@@ -650,6 +697,8 @@ def expand_struct(struct_id, new_size):
         log.debug("%s = %d", fix_args, ret)
         x_struct_id = fix_args[0]
         idc.del_struc_member(x_struct_id, ida_struct.get_struc_size(x_struct_id))
+    # members of all structs embedding the expanded one were rebuilt
+    clear_struct_members_cache()
 
 
 def get_curline_striped_from_viewer(viewer):
@@ -789,7 +838,9 @@ def refresh_struct(sptr):
     if not member_ptr:
         log.warn("Failed to add dummy field to struct 0x%X", sptr.id)
         return False
-    if not ida_struct.del_struc_member(sptr, member_ptr.soff):
+    deleted = ida_struct.del_struc_member(sptr, member_ptr.soff)
+    forget_struct_members(sptr)
+    if not deleted:
         log.error("Failed to delete dummy member at the end of struct 0x%X", sptr.id)
         return False
     return True